@@ -1,32 +1,73 @@
-import os
-from google import genai
+import orjson
+from google.genai import types
 from ingestion import get_embeddings
 from db import fetch_similar_documents
-from dotenv import load_dotenv
-load_dotenv()
 
-# Initialize Gemini AI Client
-client = genai.Client(api_key=f"{os.getenv('GEMINI_API_KEY')}")
+# Shared Gemini AI Client
+from llm_client import client
+
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# Static instruction preamble, sent as system_instruction on every call.
+# It is far below Gemini's explicit-cache minimum (1,024 tokens on this
+# model), so an explicit context cache has nothing to amortize; implicit
+# prefix caching still applies because the bytes are identical per call.
+SYSTEM_PROMPT = """
+    You are a helpful assistant. Use the provided context to answer the question.
+    Simplify the terms and answer in easy-to-understand language.
+    If the context does not contain the answer, say "I don't know".
+"""
+
+# Built once: the config object never changes between requests
+_GEN_CONFIG = types.GenerateContentConfig(system_instruction=SYSTEM_PROMPT)
+
+# Static pieces of the per-request user message. Keeping them byte-identical
+# constants (instead of re-formatting a template) also helps implicit
+# prefix caching across calls.
+_MSG_HEAD = "Context: "
+_MSG_MID = "\nQuestion: "
+_MSG_TAIL = "\nAnswer:"
+
+def _build_user_msg(context: list[dict], query: str) -> str:
+    # Long retrieved context goes first so Gemini's implicit caching can also
+    # amortize repeated document prefixes across queries in a session.
+    # Compact JSON is smaller and more token-efficient than Python's dict repr.
+    ctx_json = orjson.dumps(context).decode()
+    return "".join((_MSG_HEAD, ctx_json, _MSG_MID, query, _MSG_TAIL))
 
 def get_gemini_response(context: list[dict], query: str) -> str:
     """
     Fetch response from Google Gemini API.
     """
-    prompt = f"""
-        You are a helpful assistant. Use the following context to answer the question.
-        Simplify the terms and answer in easy-to-understand language.
-        If the context does not contain the answer, say "I don't know".
-        Context: {context}
-        Question: {query}
-        Answer:
-    """
+    user_msg = _build_user_msg(context, query)
     try:
         response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
+            model=GEMINI_MODEL,
+            contents=user_msg,
+            config=_GEN_CONFIG,
         )
         return response.text
-    
+
+    except Exception as e:
+        print(f"❌ Error fetching response: {e}")
+        return "Error fetching response from Gemini API."
+
+def get_gemini_response_stream(context: list[dict], query: str):
+    """
+    Stream the Gemini response chunk by chunk instead of buffering until EOS,
+    so callers can show text from the first token.
+    """
+    user_msg = _build_user_msg(context, query)
+    try:
+        stream = client.models.generate_content_stream(
+            model=GEMINI_MODEL,
+            contents=user_msg,
+            config=_GEN_CONFIG,
+        )
+        for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+
     except Exception as e:
         print(f"❌ Error fetching response: {e}")
-        return "Error fetching response from Gemini API."
\ No newline at end of file
+        yield "Error fetching response from Gemini API."
@@ -1,22 +1,35 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, List
 import os
-import tempfile
-import shutil
+import re
+import json
+import uuid
+import asyncio
+import aiofiles
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 # Import your existing modules
 from ingestion import process_pdf, get_embeddings
-from main import answer_query
-from db import insert, fetch_similar_documents
+from main import answer_query, answer_query_stream
+from db import insert_many, filter_new_chunks, fetch_similar_documents, get_connection, close_pool
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    close_pool()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="CampusSetu API",
     description="AI-powered document assistant for academic institutions",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -29,13 +42,18 @@ app.add_middleware(
 )
 
 # Pydantic models for request/response
+# extra='forbid' keeps validation on the fast path (no extra-field collection)
 class QueryRequest(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+
     query: str
     branch: Optional[str] = "all"
     year: Optional[str] = "all"
     top_k: Optional[int] = 5
 
 class QueryResponse(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+
     answer: str
     query: str
     branch: str
@@ -43,15 +61,17 @@ class QueryResponse(BaseModel):
     timestamp: str
     context_used: int
 
-class DocumentUploadResponse(BaseModel):
-    message: str
+class UploadJobResponse(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+
+    job_id: str
+    status: str
     doc_name: str
-    chunks_processed: int
-    branch: str
-    year: str
-    doc_id: str
+    message: str
 
 class SimilarDocument(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+
     content: str
     doc_name: str
     branch: str
@@ -61,6 +81,8 @@ class SimilarDocument(BaseModel):
     valid_to: Optional[str]
 
 class SearchResponse(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+
     documents: List[SimilarDocument]
     total_found: int
     query_embedding_success: bool
@@ -81,12 +103,10 @@ async def health_check():
     """Detailed health check"""
     try:
         # Test database connection
-        from db import get_db_connection
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        cursor.close()
-        conn.close()
+        with get_connection(readonly=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
         db_status = "connected"
     except Exception as e:
         db_status = f"error: {str(e)}"
@@ -97,8 +117,89 @@ async def health_check():
         "timestamp": datetime.now().isoformat()
     }
 
-@app.post("/upload-document/", response_model=DocumentUploadResponse)
+_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+def process_date(date_str: Optional[str]) -> Optional[str]:
+    """
+    Normalize an optional YYYY-MM-DD form value, returning None for anything
+    invalid (including Swagger's '', 'string', and 'null' placeholders)
+    """
+    if not date_str or not date_str.strip() or date_str.lower() in ["null", "none", "string"]:
+        return None
+    # Regex reject is far cheaper than strptime's exception path for the
+    # common malformed inputs
+    if not _DATE_RE.match(date_str):
+        return None
+    try:
+        datetime.strptime(date_str, "%Y-%m-%d")
+        return date_str
+    except ValueError:
+        return None
+
+# In-process registry of ingestion jobs, keyed by job_id and capped so
+# finished records don't accumulate for the life of the process. Oldest
+# entries are evicted first; the worker receives its record directly, so
+# an eviction only affects status polling, not the job itself.
+_JOBS: OrderedDict = OrderedDict()
+_MAX_JOBS = 200
+
+def _register_job(job_id: str, record: dict):
+    _JOBS[job_id] = record
+    while len(_JOBS) > _MAX_JOBS:
+        _JOBS.popitem(last=False)
+
+def _ingest_document(job, pdf_bytes, doc_name, branch, year, valid_from, valid_to):
+    """Run the PDF -> chunks -> embeddings -> insert pipeline for a queued upload"""
+    job["status"] = "processing"
+    try:
+        chunks = process_pdf(pdf_bytes)
+        if not chunks:
+            job["status"] = "failed"
+            job["error"] = "Failed to process PDF. Please check the file."
+            return
+
+        # Skip chunks that are already stored - embedding is the expensive
+        # step, and re-uploads of mostly-unchanged PDFs are common
+        chunks = filter_new_chunks(chunks)
+        if not chunks:
+            job["status"] = "completed"
+            job["chunks_processed"] = 0
+            job["message"] = "All chunks already stored; nothing new to embed"
+            return
+
+        embeddings = get_embeddings(chunks)
+        if not embeddings:
+            job["status"] = "failed"
+            job["error"] = "Failed to generate embeddings"
+            return
+
+        # Insert all chunks in one batched statement
+        doc_id = insert_many(
+            chunks=chunks,
+            embeddings=embeddings,
+            doc_name=doc_name,
+            branch=branch,
+            year=year,
+            valid_from=valid_from,
+            valid_to=valid_to
+        )
+        if doc_id is None:
+            # insert_many reports failure with None - nothing was written
+            job["status"] = "failed"
+            job["error"] = "Failed to store chunks in the database"
+            return
+
+        job["status"] = "completed"
+        job["chunks_processed"] = len(chunks)
+        job["doc_id"] = doc_id
+
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+
+@app.post("/upload-document/", response_model=UploadJobResponse, status_code=202)
 async def upload_document(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     doc_name: str = Form(...),
     branch: str = Form(default="all"),
@@ -107,79 +208,87 @@ async def upload_document(
     valid_to: Optional[str] = Form(default="")
 ):
     """
-    Upload a PDF document and process it into the knowledge base
+    Upload a PDF document and queue it for ingestion. Processing (parsing,
+    embedding, insert) runs in the background; poll /jobs/{job_id} for progress
     """
     try:
         # Validate file type
         if not file.filename.lower().endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Only PDF files are supported")
-        
+
         # Create documents directory if it doesn't exist
         os.makedirs("documents", exist_ok=True)
-        
-        # Save uploaded file temporarily
+
+        # Read the upload once; parsing works off these bytes directly so the
+        # file isn't re-read from disk. The copy under documents/ is kept for
+        # auditing, written without blocking the event loop.
+        pdf_bytes = await file.read()
         temp_file_path = os.path.join("documents", file.filename)
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Process PDF and get chunks
-        chunks = process_pdf(file.filename)
-        if not chunks:
-            raise HTTPException(status_code=400, detail="Failed to process PDF. Please check the file.")
-        
-        # Get embeddings
-        embeddings = get_embeddings(chunks)
-        if not embeddings:
-            raise HTTPException(status_code=500, detail="Failed to generate embeddings")
-        
+        async with aiofiles.open(temp_file_path, "wb") as buffer:
+            await buffer.write(pdf_bytes)
+
         # Process and validate dates
-        def process_date(date_str):
-            if not date_str or not date_str.strip() or date_str.lower() in ["", "null", "none", "string"]:
-                return None
-            # Basic date validation - you can make this more sophisticated
-            try:
-                # Try to parse the date to validate format
-                from datetime import datetime
-                datetime.strptime(date_str, "%Y-%m-%d")
-                return date_str
-            except ValueError:
-                return None
-        
         processed_valid_from = process_date(valid_from)
         processed_valid_to = process_date(valid_to)
-        
-        # Insert into database
-        doc_id = None
-        for chunk, embedding in zip(chunks, embeddings):
-            result = insert(
-                content=chunk,
-                embedding=embedding,
-                doc_name=doc_name,
-                branch=branch,
-                year=year,
-                valid_from=processed_valid_from,
-                valid_to=processed_valid_to
-            )
-            if not doc_id:
-                doc_id = "generated"  # You might want to return the actual doc_id from insert function
-        
-        # Clean up temporary file (optional)
-        # os.remove(temp_file_path)
-        
-        return DocumentUploadResponse(
-            message="Document uploaded and processed successfully",
+
+        # Queue the heavy work and return immediately
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "doc_name": doc_name,
+            "chunks_processed": 0
+        }
+        _register_job(job_id, job)
+        # Hand the record itself to the worker: a registry eviction between
+        # queueing and execution must not be able to kill the ingestion
+        background_tasks.add_task(
+            _ingest_document,
+            job,
+            pdf_bytes,
+            doc_name,
+            branch,
+            year,
+            processed_valid_from,
+            processed_valid_to
+        )
+
+        # Server-built payload - skip re-validation
+        return UploadJobResponse.model_construct(
+            job_id=job_id,
+            status="queued",
             doc_name=doc_name,
-            chunks_processed=len(chunks),
-            branch=branch,
-            year=year,
-            doc_id=doc_id or "generated"
+            message="Document queued for processing"
         )
-        
+
     except HTTPException as he:
         raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
 
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """
+    Check the status of a queued document-ingestion job
+    """
+    job = _JOBS.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+async def _count_context(query_embedding: Optional[List[float]], branch: str, year: str, top_k: int) -> int:
+    """Count how many context chunks the similarity search returns for a query"""
+    if not query_embedding:
+        return 0
+    similar_docs = await asyncio.to_thread(
+        fetch_similar_documents,
+        query_embedding,
+        top_k,
+        branch,
+        year
+    )
+    return len(similar_docs)
+
 @app.post("/query/", response_model=QueryResponse)
 async def query_documents(request: QueryRequest):
     """
@@ -188,28 +297,34 @@ async def query_documents(request: QueryRequest):
     try:
         if not request.query.strip():
             raise HTTPException(status_code=400, detail="Query cannot be empty")
-        
-        # Get answer using your existing function
-        answer = answer_query(request.query, request.branch, request.year)
-        
+
+        # Embed the query once and share it across both legs below
+        query_embeddings = await asyncio.to_thread(get_embeddings, [request.query])
+        query_embedding = query_embeddings[0] if query_embeddings else None
+
+        # The Gemini answer and the context count are independent - run them
+        # concurrently so the LLM round-trip overlaps the similarity search
+        answer, context_count = await asyncio.gather(
+            asyncio.to_thread(
+                answer_query,
+                request.query,
+                request.branch,
+                request.year,
+                embedding=query_embedding
+            ),
+            _count_context(
+                query_embedding,
+                request.branch or "all",
+                request.year or "all",
+                request.top_k or 5
+            )
+        )
+
         if not answer:
             raise HTTPException(status_code=404, detail="No relevant context found in the database")
-        
-        # Get embedding for context count (optional)
-        from ingestion import get_embeddings
-        query_embedding = get_embeddings([request.query])[0] if get_embeddings([request.query]) else None
-        context_count = 0
-        
-        if query_embedding:
-            similar_docs = fetch_similar_documents(
-                query_embedding, 
-                top_k=request.top_k or 5, 
-                branch=request.branch or "all", 
-                year=request.year or "all"
-            )
-            context_count = len(similar_docs)
-        
-        return QueryResponse(
+
+        # Server-built payload - skip re-validation
+        return QueryResponse.model_construct(
             answer=answer,
             query=request.query,
             branch=request.branch or "all",
@@ -223,6 +338,29 @@ async def query_documents(request: QueryRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
+@app.post("/query/stream/")
+async def query_documents_stream(request: QueryRequest):
+    """
+    Query the knowledge base and stream the answer as server-sent events,
+    so clients can render text from the first token instead of waiting for
+    the full generation
+    """
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+
+    async def event_generator():
+        stream = answer_query_stream(request.query, request.branch, request.year)
+        while True:
+            # answer_query_stream is a sync generator - pull each piece off
+            # the event loop so slow Gemini chunks don't block other requests
+            piece = await asyncio.to_thread(next, stream, None)
+            if piece is None:
+                break
+            yield f"data: {json.dumps({'text': piece})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
 @app.post("/search-similar/", response_model=SearchResponse)
 async def search_similar_documents(request: QueryRequest):
     """
@@ -233,11 +371,10 @@ async def search_similar_documents(request: QueryRequest):
             raise HTTPException(status_code=400, detail="Query cannot be empty")
         
         # Get embedding for the query
-        from ingestion import get_embeddings
         query_embeddings = get_embeddings([request.query])
         
         if not query_embeddings or not query_embeddings[0]:
-            return SearchResponse(
+            return SearchResponse.model_construct(
                 documents=[],
                 total_found=0,
                 query_embedding_success=False
@@ -253,9 +390,9 @@ async def search_similar_documents(request: QueryRequest):
             year=request.year or "all"
         )
         
-        # Convert to response format
+        # Convert to response format (trusted rows from our own DB layer)
         documents = [
-            SimilarDocument(
+            SimilarDocument.model_construct(
                 content=doc["content"],
                 doc_name=doc["doc_name"],
                 branch=doc["branch"],
@@ -267,7 +404,7 @@ async def search_similar_documents(request: QueryRequest):
             for doc in similar_docs
         ]
         
-        return SearchResponse(
+        return SearchResponse.model_construct(
             documents=documents,
             total_found=len(documents),
             query_embedding_success=True
@@ -282,47 +419,42 @@ async def get_document_stats():
     Get statistics about uploaded documents
     """
     try:
-        from db import get_db_connection
-        
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        
-        # Get total documents count
-        cursor.execute("SELECT COUNT(DISTINCT doc_name) FROM documents")
-        result = cursor.fetchone()
-        total_docs = result[0] if result else 0
-        
-        # Get total chunks count
-        cursor.execute("SELECT COUNT(*) FROM documents")
-        result = cursor.fetchone()
-        total_chunks = result[0] if result else 0
-        
-        # Get documents by branch
-        cursor.execute("""
-            SELECT branch, COUNT(DISTINCT doc_name) as doc_count 
-            FROM documents 
-            GROUP BY branch 
-            ORDER BY doc_count DESC
-        """)
-        branch_stats = cursor.fetchall()
-        
-        # Get documents by year
-        cursor.execute("""
-            SELECT year, COUNT(DISTINCT doc_name) as doc_count 
-            FROM documents 
-            GROUP BY year 
-            ORDER BY doc_count DESC
-        """)
-        year_stats = cursor.fetchall()
-        
-        cursor.close()
-        connection.close()
-        
+        with get_connection(readonly=True) as connection:
+            cursor = connection.cursor()
+
+            # Totals and both breakdowns in a single round-trip: one plan,
+            # one scan, one fetchone() instead of four execute calls
+            cursor.execute("""
+                WITH totals AS (
+                    SELECT COUNT(DISTINCT doc_name) AS total_documents,
+                           COUNT(*) AS total_chunks
+                    FROM documents
+                ),
+                by_branch AS (
+                    SELECT branch, COUNT(DISTINCT doc_name) AS doc_count
+                    FROM documents
+                    GROUP BY branch
+                    ORDER BY doc_count DESC
+                ),
+                by_year AS (
+                    SELECT year, COUNT(DISTINCT doc_name) AS doc_count
+                    FROM documents
+                    GROUP BY year
+                    ORDER BY doc_count DESC
+                )
+                SELECT (SELECT row_to_json(totals) FROM totals),
+                       (SELECT json_agg(by_branch) FROM by_branch),
+                       (SELECT json_agg(by_year) FROM by_year)
+            """)
+            totals, branch_stats, year_stats = cursor.fetchone()
+
+            cursor.close()
+
         return {
-            "total_documents": total_docs,
-            "total_chunks": total_chunks,
-            "documents_by_branch": {branch: count for branch, count in branch_stats},
-            "documents_by_year": {year: count for year, count in year_stats},
+            "total_documents": totals["total_documents"] if totals else 0,
+            "total_chunks": totals["total_chunks"] if totals else 0,
+            "documents_by_branch": {row["branch"]: row["doc_count"] for row in (branch_stats or [])},
+            "documents_by_year": {row["year"]: row["doc_count"] for row in (year_stats or [])},
             "timestamp": datetime.now().isoformat()
         }
         
@@ -339,17 +471,10 @@ async def list_documents(
     List uploaded documents with optional filtering
     """
     try:
-        from db import get_db_connection
-        
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        
         # Build query with optional filters
         query = """
-            SELECT DISTINCT doc_name, branch, year, valid_from, valid_to, 
-                   COUNT(*) as chunk_count,
-                   MIN(CASE WHEN valid_from IS NOT NULL THEN valid_from END) as earliest_valid,
-                   MAX(CASE WHEN valid_to IS NOT NULL THEN valid_to END) as latest_valid
+            SELECT DISTINCT doc_name, branch, year, valid_from, valid_to,
+                   COUNT(*) as chunk_count
             FROM documents
         """
         
@@ -371,11 +496,17 @@ async def list_documents(
         query += " ORDER BY doc_name"
         
         if limit:
-            query += f" LIMIT {limit}"
-        
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        
+            # Bound parameter (not an f-string) so Postgres reuses one plan
+            # across different limit values
+            query += " LIMIT %s"
+            params.append(limit)
+
+        with get_connection(readonly=True) as connection:
+            cursor = connection.cursor()
+            cursor.execute(query, params)
+            results = cursor.fetchall()
+            cursor.close()
+
         documents = [
             {
                 "doc_name": row[0],
@@ -387,10 +518,7 @@ async def list_documents(
             }
             for row in results
         ]
-        
-        cursor.close()
-        connection.close()
-        
+
         return {
             "documents": documents,
             "total_found": len(documents),
@@ -1,14 +1,15 @@
 import streamlit as st
 import os
 import tempfile
+from collections import deque
 from datetime import datetime
 from typing import Optional
 import time
 
 # Import your existing modules
 from ingestion import add_document_to_db, process_pdf, get_embeddings
-from main import answer_query
-from db import insert
+from main import answer_query, answer_query_stream
+from db import insert_many, filter_new_chunks
 
 # Page configuration
 st.set_page_config(
@@ -58,7 +59,8 @@ st.markdown("""
 if 'upload_success' not in st.session_state:
     st.session_state.upload_success = False
 if 'query_history' not in st.session_state:
-    st.session_state.query_history = []
+    # Bounded so a long session can't grow the rerun cost without limit
+    st.session_state.query_history = deque(maxlen=200)
 
 def main():
     # Header
@@ -174,20 +176,30 @@ def process_and_upload_document(uploaded_file, doc_name, branch, year, valid_fro
         if not os.path.exists("documents"):
             os.makedirs("documents")
         
-        # Save uploaded file temporarily
+        # Keep a copy under documents/ for auditing; parsing works off the
+        # in-memory bytes so the file isn't re-read from disk
+        pdf_bytes = uploaded_file.getvalue()
         temp_path = os.path.join("documents", uploaded_file.name)
         with open(temp_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        
+            f.write(pdf_bytes)
+
         status_text.text("📄 Processing PDF...")
         progress_bar.progress(25)
-        
+
         # Process PDF and get chunks
-        chunks = process_pdf(uploaded_file.name)
+        chunks = process_pdf(pdf_bytes)
         if not chunks:
             st.error("❌ Failed to process PDF. Please check the file.")
             return
-        
+
+        # Skip chunks that are already stored so unchanged content isn't re-embedded
+        chunks = filter_new_chunks(chunks)
+        if not chunks:
+            progress_bar.progress(100)
+            status_text.text("✅ Nothing new to process!")
+            st.info("ℹ️ All chunks of this document are already in the knowledge base.")
+            return
+
         status_text.text("🔤 Generating embeddings...")
         progress_bar.progress(50)
         
@@ -204,17 +216,16 @@ def process_and_upload_document(uploaded_file, doc_name, branch, year, valid_fro
         valid_from_str = valid_from.strftime("%Y-%m-%d") if valid_from else None
         valid_to_str = valid_to.strftime("%Y-%m-%d") if valid_to else None
         
-        # Insert into database
-        for chunk, embedding in zip(chunks, embeddings):
-            insert(
-                content=chunk,
-                embedding=embedding,
-                doc_name=doc_name,
-                branch=branch,
-                year=year,
-                valid_from=valid_from_str,
-                valid_to=valid_to_str
-            )
+        # Insert all chunks in one batched statement
+        insert_many(
+            chunks=chunks,
+            embeddings=embeddings,
+            doc_name=doc_name,
+            branch=branch,
+            year=year,
+            valid_from=valid_from_str,
+            valid_to=valid_to_str
+        )
         
         progress_bar.progress(100)
         status_text.text("✅ Upload completed successfully!")
@@ -305,46 +316,40 @@ def query_page():
         """)
 
 def get_answer(query, branch, year, top_k):
-    """Get answer for user query"""
-    
-    with st.spinner("🤔 Thinking..."):
-        try:
-            # Get answer from your existing function with branch and year filters
-            answer = answer_query(query, branch, year)
-            
-            if answer and answer != "No relevant context found in the database.":
-                st.markdown("### 🎯 Answer:")
-                st.markdown(f"""
-                <div class="success-box">
-                {answer}
-                </div>
-                """, unsafe_allow_html=True)
-                
-                # Show which filters were applied
-                if branch != "all" or year != "all":
-                    filter_info = []
-                    if branch != "all":
-                        filter_info.append(f"Branch: {branch}")
-                    if year != "all":
-                        filter_info.append(f"Year: {year}")
-                    st.info(f"🔍 Filters applied: {', '.join(filter_info)}")
-                
-                # Add to history
-                st.session_state.query_history.append({
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "query": query,
-                    "branch": branch,
-                    "year": year,
-                    "answer": answer
-                })
-                
-                st.success("✅ Answer generated successfully!")
-                
-            else:
-                st.warning("⚠️ No relevant information found in the database. Try uploading more documents or rephrasing your question.")
-                
-        except Exception as e:
-            st.error(f"❌ Error generating answer: {str(e)}")
+    """Get answer for user query, rendering tokens as they stream in"""
+
+    try:
+        st.markdown("### 🎯 Answer:")
+        # Stream the answer so the user reads from the first token instead
+        # of staring at a spinner for the whole generation
+        answer = st.write_stream(answer_query_stream(query, branch, year))
+
+        if answer and answer != "No relevant context found in the database.":
+            # Show which filters were applied
+            if branch != "all" or year != "all":
+                filter_info = []
+                if branch != "all":
+                    filter_info.append(f"Branch: {branch}")
+                if year != "all":
+                    filter_info.append(f"Year: {year}")
+                st.info(f"🔍 Filters applied: {', '.join(filter_info)}")
+
+            # Add to history
+            st.session_state.query_history.append({
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "query": query,
+                "branch": branch,
+                "year": year,
+                "answer": answer
+            })
+
+            st.success("✅ Answer generated successfully!")
+
+        else:
+            st.warning("⚠️ No relevant information found in the database. Try uploading more documents or rephrasing your question.")
+
+    except Exception as e:
+        st.error(f"❌ Error generating answer: {str(e)}")
 
 def history_page():
     st.markdown("## 📊 Query History")
@@ -354,14 +359,20 @@ def history_page():
         
         # Clear history button
         if st.button("🗑️ Clear History", type="secondary"):
-            st.session_state.query_history = []
+            st.session_state.query_history.clear()
             st.rerun()
-        
+
         st.markdown("---")
-        
-        # Display history in reverse order (newest first)
-        for i, entry in enumerate(reversed(st.session_state.query_history)):
-            with st.expander(f"**Query {len(st.session_state.query_history) - i}:** {entry['query'][:50]}..."):
+
+        # Render only the most recent page (newest first) so the rerun stays
+        # O(page_size) instead of O(total queries)
+        page_size = 20
+        total = len(st.session_state.query_history)
+        recent = list(st.session_state.query_history)[-page_size:]
+        if total > page_size:
+            st.caption(f"Showing the {page_size} most recent queries")
+        for i, entry in enumerate(reversed(recent)):
+            with st.expander(f"**Query {total - i}:** {entry['query'][:50]}..."):
                 st.markdown(f"**🕒 Time:** {entry['timestamp']}")
                 st.markdown(f"**🏢 Branch:** {entry['branch']}")
                 st.markdown(f"**📅 Year:** {entry['year']}")
@@ -0,0 +1,33 @@
+import os
+from dataclasses import dataclass
+from urllib.parse import quote
+from dotenv import load_dotenv
+
+# Parse .env exactly once, at first import. Every other module pulls the
+# frozen SETTINGS object instead of re-reading the file and re-looking-up
+# environment variables per call.
+load_dotenv()
+
+@dataclass(frozen=True)
+class Settings:
+    pg_dsn: str
+    gemini_key: str
+    db_pool_size: int
+    debug_rag: bool
+    fast_split: bool
+
+SETTINGS = Settings(
+    # DSN form lets libpq parse the connection parameters once and reuse
+    # them. Credentials are percent-escaped (quote, not quote_plus: libpq
+    # only percent-decodes URI components, so a '+' for a space would be
+    # taken literally) so characters like @ : / # or spaces in a password
+    # can't corrupt the connection string.
+    pg_dsn=(
+        f"postgresql://{quote(os.getenv('user') or '', safe='')}:{quote(os.getenv('password') or '', safe='')}"
+        f"@{os.getenv('host')}:{os.getenv('port')}/{quote(os.getenv('dbname') or '', safe='')}"
+    ),
+    gemini_key=os.getenv("GEMINI_API_KEY", ""),
+    db_pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+    debug_rag=bool(os.getenv("DEBUG_RAG")),
+    fast_split=bool(os.getenv("CAMPUSSETU_FAST_SPLIT")),
+)
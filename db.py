@@ -1,27 +1,125 @@
+import numpy as np
 import psycopg2
-from dotenv import load_dotenv
-import os
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
+from contextlib import contextmanager
+from pgvector import HalfVector
+from pgvector.psycopg2 import register_vector
+import hashlib
 from typing import Optional
 import uuid
 
-# Load environment variables from .env
-load_dotenv()
+from config import SETTINGS
 
-# Fetch variables
-USER = os.getenv("user")
-PASSWORD = os.getenv("password")
-HOST = os.getenv("host")
-PORT = os.getenv("port")
-DBNAME = os.getenv("dbname")
+class _VectorConnection(psycopg2.extensions.connection):
+    """
+    Connection that registers the pgvector type adapters on creation, so
+    embeddings travel as typed vector literals instead of float8 arrays the
+    server has to re-parse and cast per row.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        register_vector(self)
+        # register_vector runs a SELECT, which opens an implicit transaction
+        # on this non-autocommit connection. Close it so the connection isn't
+        # handed out idle-in-transaction and set_session in the read-only
+        # subclass (which refuses to run inside a transaction) still works.
+        self.rollback()
 
-def get_db_connection():
-    return psycopg2.connect(
-        user=USER,
-        password=PASSWORD,
-        host=HOST,
-        port=PORT,
-        dbname=DBNAME
+# Size of the first-stage candidate pool. ef_search must be at least this
+# large: with iterative scan off an HNSW scan returns at most ef_search
+# tuples, so a smaller ef_search would silently shrink the re-rank pool
+# below what the prepared statements ask for.
+_CANDIDATE_POOL = 200
+
+# The hot similarity SELECT, prepared once per read connection so each query
+# is an EXECUTE instead of a fresh parse+plan. Two-stage shape: the CTE walks
+# the binary-quantized HNSW index by Hamming distance for the candidate
+# pool, the outer query re-ranks with exact halfvec cosine. One variant per
+# filter combination; $1 is referenced twice so the vector travels once.
+_SEARCH_BODY = f"""
+    WITH candidates AS (
+        SELECT content, doc_name, branch, year, valid_from, valid_to, embedding
+        FROM documents{{where_clause}}
+        ORDER BY binary_quantize(embedding)::bit(768) <~> binary_quantize($1)
+        LIMIT {_CANDIDATE_POOL}
     )
+    SELECT content, doc_name, branch, year, valid_from, valid_to,
+           CAST(1 - (embedding <=> $1) AS double precision) AS similarity
+    FROM candidates
+    ORDER BY similarity DESC
+    LIMIT ${{limit_arg}};
+"""
+
+_PREPARED_SEARCHES = {
+    "rag_search_all": "PREPARE rag_search_all(halfvec, integer) AS" + _SEARCH_BODY.format(
+        where_clause="", limit_arg=2
+    ),
+    "rag_search_branch": "PREPARE rag_search_branch(halfvec, text, integer) AS" + _SEARCH_BODY.format(
+        where_clause=" WHERE (branch = $2 OR branch = 'all')", limit_arg=3
+    ),
+    "rag_search_year": "PREPARE rag_search_year(halfvec, text, integer) AS" + _SEARCH_BODY.format(
+        where_clause=" WHERE (year = $2 OR year = 'all')", limit_arg=3
+    ),
+    "rag_search_branch_year": "PREPARE rag_search_branch_year(halfvec, text, text, integer) AS" + _SEARCH_BODY.format(
+        where_clause=" WHERE (branch = $2 OR branch = 'all') AND (year = $3 OR year = 'all')",
+        limit_arg=4
+    ),
+}
+
+class _ReadOnlyVectorConnection(_VectorConnection):
+    """
+    Vector connection for the query path: autocommit skips the implicit
+    BEGIN/COMMIT around every SELECT, and read-only lets Postgres shortcut
+    some MVCC bookkeeping. The similarity-search statements are prepared
+    here once, then live as long as the pooled connection does.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_session(readonly=True, autocommit=True)
+        with self.cursor() as cursor:
+            for statement in _PREPARED_SEARCHES.values():
+                cursor.execute(statement)
+
+def get_db_connection():
+    return psycopg2.connect(SETTINGS.pg_dsn, connection_factory=_VectorConnection)
+
+# Long-lived connection pools so requests reuse connections instead of paying
+# a fresh TCP+auth handshake every call. Reads and writes go through separate
+# pools: the read pool is autocommit/read-only, and a slow ingest holding
+# write connections can't starve query latency.
+_POOLS: dict = {}
+
+def _get_pool(readonly: bool = False) -> psycopg2.pool.ThreadedConnectionPool:
+    pool = _POOLS.get(readonly)
+    if pool is None:
+        pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn=1,
+            maxconn=SETTINGS.db_pool_size,
+            dsn=SETTINGS.pg_dsn,
+            connection_factory=_ReadOnlyVectorConnection if readonly else _VectorConnection
+        )
+        _POOLS[readonly] = pool
+    return pool
+
+@contextmanager
+def get_connection(readonly: bool = False):
+    """
+    Borrow a connection from the pool and return it when done. Pass
+    readonly=True on paths that only SELECT.
+    """
+    pool = _get_pool(readonly)
+    connection = pool.getconn()
+    try:
+        yield connection
+    finally:
+        pool.putconn(connection)
+
+def close_pool():
+    for pool in _POOLS.values():
+        pool.closeall()
+    _POOLS.clear()
 # Connect to the database
 # try:
 #     connection = get_db_connection()
@@ -44,6 +142,41 @@ def get_db_connection():
 # except Exception as e:
 #     print(f"Failed to connect: {e}")
 
+def _content_hash(content: str) -> str:
+    return hashlib.sha1(content.encode()).hexdigest()
+
+def fetch_existing_hashes(hashes: list[str]) -> set[str]:
+    """
+    Return the subset of content hashes that are already stored.
+    """
+    if not hashes:
+        return set()
+    try:
+        with get_connection(readonly=True) as connection, connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT content_hash FROM documents WHERE content_hash = ANY(%s)",
+                (hashes,)
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    except Exception as e:
+        print(f"❌ Error checking existing chunks: {e}")
+        return set()
+
+def filter_new_chunks(chunks: list[str]) -> list[str]:
+    """
+    Drop chunks whose content is already stored (or repeated within the same
+    upload), so unchanged content is never re-embedded or re-inserted.
+    """
+    hashes = [_content_hash(chunk) for chunk in chunks]
+    seen = fetch_existing_hashes(hashes)
+    new_chunks = []
+    for chunk, content_hash in zip(chunks, hashes):
+        if content_hash not in seen:
+            seen.add(content_hash)
+            new_chunks.append(chunk)
+    return new_chunks
+
 def insert(
     content: str,
     embedding: list[float],
@@ -58,26 +191,67 @@ def insert(
     """
     try:
         doc_id = str(uuid.uuid4())  # Convert UUID to string
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        cursor.execute(
-            """
-            INSERT INTO documents (content, embedding, doc_name, branch, year, valid_from, valid_to, doc_id)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-            (content, embedding, doc_name, branch, year, valid_from, valid_to, doc_id)
-        )
-        connection.commit()
+        with get_connection() as connection, connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO documents (content, embedding, doc_name, branch, year, valid_from, valid_to, doc_id, content_hash)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (content, np.asarray(embedding, dtype=np.float32), doc_name, branch, year, valid_from, valid_to, doc_id, _content_hash(content))
+            )
+            connection.commit()
         print("Document metadata inserted successfully.")
 
     except Exception as e:
         print(f"❌ Error inserting document metadata: {e}")
 
-    finally:
-        cursor.close()
+def insert_many(
+    chunks: list[str],
+    embeddings: list[list[float]],
+    doc_name: str,
+    branch: Optional[str] = "all",
+    year: Optional[str] = "all",
+    valid_from: Optional[str] = None,
+    valid_to: Optional[str] = None,
+    doc_id: Optional[str] = None
+) -> Optional[str]:
+    """
+    Insert all chunks of a document in one batched statement instead of one
+    round-trip per chunk. Pass doc_id when the document's chunks arrive in
+    several batches that should share one id.
+    """
+    try:
+        doc_id = doc_id or str(uuid.uuid4())  # One doc_id shared by all chunks of the document
+        rows = [
+            (content, np.asarray(embedding, dtype=np.float32), doc_name, branch, year, valid_from, valid_to, doc_id, _content_hash(content))
+            for content, embedding in zip(chunks, embeddings)
+        ]
+        with get_connection() as connection, connection.cursor() as cursor:
+            # execute_values folds many rows into each INSERT statement, unlike
+            # executemany which still runs one statement per row
+            psycopg2.extras.execute_values(
+                cursor,
+                """
+                INSERT INTO documents (content, embedding, doc_name, branch, year, valid_from, valid_to, doc_id, content_hash)
+                VALUES %s
+                """,
+                rows,
+                page_size=200
+            )
+            connection.commit()
+        print(f"Inserted {len(rows)} chunks for document '{doc_name}'.")
+        return doc_id
+
+    except Exception as e:
+        print(f"❌ Error inserting document chunks: {e}")
+        return None
+
+# Column order of the similarity SELECT below; zipped against each row to
+# build result dicts without per-field indexing.
+_RESULT_KEYS = ("content", "doc_name", "branch", "year", "valid_from", "valid_to", "similarity")
 
 def fetch_similar_documents(
-    query_embedding: list[float], 
+    query_embedding: list[float],
     top_k: int = 5,
     branch: Optional[str] = "all",
     year: Optional[str] = "all"
@@ -89,52 +263,50 @@ def fetch_similar_documents(
         print("⚠️ Skipping search due to embedding fetch failure.")
         return []
 
-    # Build the base SQL query with similarity scoring
-    sql_query = """
-        SELECT content, doc_name, branch, year, valid_from, valid_to, 
-               1 - (embedding <=> %s::vector) AS similarity 
-        FROM documents
-    """
-    
-    # Build WHERE clause conditions
-    conditions = []
-    params: list = [query_embedding]
-    
-    if branch and branch != "all":
-        conditions.append("(branch = %s OR branch = 'all')")
-        params.append(branch)
-    
-    if year and year != "all":
-        conditions.append("(year = %s OR year = 'all')")
-        params.append(year)
-    
-    # Add WHERE clause if there are conditions
-    if conditions:
-        sql_query += " WHERE " + " AND ".join(conditions)
-    
-    # Add ORDER BY and LIMIT
-    sql_query += " ORDER BY similarity DESC LIMIT %s;"
-    params.append(top_k)
+    # Pick the statement prepared at connection init for this filter shape
+    # (see _PREPARED_SEARCHES); EXECUTE skips per-request parse and plan.
+    qvec = HalfVector(np.asarray(query_embedding, dtype=np.float32))
+    has_branch = bool(branch) and branch != "all"
+    has_year = bool(year) and year != "all"
+
+    if has_branch and has_year:
+        statement, params = "rag_search_branch_year", [qvec, branch, year, top_k]
+    elif has_branch:
+        statement, params = "rag_search_branch", [qvec, branch, top_k]
+    elif has_year:
+        statement, params = "rag_search_year", [qvec, year, top_k]
+    else:
+        statement, params = "rag_search_all", [qvec, top_k]
+
+    placeholders = ", ".join(["%s"] * len(params))
 
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        cursor.execute(sql_query, params)
-        results = cursor.fetchall()
-        print(f"found {len(results)} results")
-        print([row[0] for row in results])
-        documents = [
-            {
-                "content": row[0],
-                "doc_name": row[1],
-                "branch": row[2],
-                "year": row[3],
-                "valid_from": row[4],
-                "valid_to": row[5],
-                "similarity": float(row[6])
-            }
-            for row in results
-        ]
+        with get_connection(readonly=True) as connection, connection.cursor() as cursor:
+            # Widen the HNSW candidate list. The read pool runs autocommit,
+            # so there is no transaction for SET LOCAL to scope to; these are
+            # session-level SETs, set explicitly on every call (including the
+            # iterative_scan "off" branch) so nothing leaks between borrowers
+            # of the same pooled connection. Floor of 100 keeps recall
+            # near-exact; scales up for very large top_k. Floored at the
+            # candidate-pool size so the first stage can actually return
+            # _CANDIDATE_POOL tuples when iterative scan is off.
+            cursor.execute("SET hnsw.ef_search = %s;", (max(_CANDIDATE_POOL, top_k * 4),))
+            if has_branch or has_year:
+                # Branch/year predicates are post-filters on the index scan;
+                # iterative scan (pgvector >= 0.8) keeps traversing the graph
+                # until top_k rows survive the filter instead of coming back
+                # short when a filter is selective.
+                cursor.execute("SET hnsw.iterative_scan = relaxed_order;")
+            else:
+                cursor.execute("SET hnsw.iterative_scan = off;")
+            cursor.execute(f"EXECUTE {statement}({placeholders})", params)
+            results = cursor.fetchall()
+        if SETTINGS.debug_rag:
+            print(f"found {len(results)} results")
+            print([row[0] for row in results])
+        # The SELECT casts similarity to double precision, so psycopg2 hands
+        # back a Python float already - no per-row float() call needed.
+        documents = [dict(zip(_RESULT_KEYS, row)) for row in results]
         
         # Print Results Neatly (optional - uncomment if needed)
         # if documents:
@@ -151,5 +323,23 @@ def fetch_similar_documents(
         print(f"❌ Database error: {e}")
         return []
 
-    finally:
-        cursor.close()
\ No newline at end of file
+def fetch_embedding_snapshot(limit: int = 10000) -> list[tuple]:
+    """
+    Pull up to `limit` rows with their embeddings for the in-process
+    re-ranker in main.py. Returns raw (content, doc_name, branch, year,
+    valid_from, valid_to, embedding) tuples; empty list on failure.
+    """
+    try:
+        with get_connection(readonly=True) as connection, connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT content, doc_name, branch, year, valid_from, valid_to, embedding
+                FROM documents
+                LIMIT %s;
+                """,
+                (limit,)
+            )
+            return cursor.fetchall()
+    except Exception as e:
+        print(f"❌ Database error: {e}")
+        return []
\ No newline at end of file
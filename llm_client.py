@@ -0,0 +1,8 @@
+from google import genai
+
+from config import SETTINGS
+
+# One shared Gemini client for the whole app. Each Client owns its own HTTP
+# connection pool, so the previous per-module instances doubled TLS
+# handshakes and kept separate keep-alive pools for the same API.
+client = genai.Client(api_key=SETTINGS.gemini_key)
@@ -1,26 +1,145 @@
-import os
-from google import genai
-from db import fetch_similar_documents
+import threading
+import time
+import numpy as np
+from db import fetch_similar_documents, fetch_embedding_snapshot
 from ingestion import get_embeddings
-from agent import get_gemini_response
+from agent import get_gemini_response, get_gemini_response_stream
 from typing import Optional
-from dotenv import load_dotenv
-load_dotenv()
 
-# Initialize Gemini AI Client
-client = genai.Client(api_key=f"{os.getenv('GEMINI_API_KEY')}")
+# Optional: Numba compiles the cosine loop to vectorized native code. The
+# numpy matmul fallback is already fast; numba mainly wins on many-core boxes.
+try:
+    from numba import njit, prange
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
 
-def answer_query(query: str, branch: Optional[str] = "all", year: Optional[str] = "all") -> str:
+# In-process copy of the corpus embeddings, so unfiltered queries skip the
+# Postgres round-trip entirely. Refreshed on a TTL; anything ingested since
+# the last refresh shows up within _HOT_SET_TTL seconds. Falls back to the
+# DB whenever the snapshot can't be trusted (filters, overflow, load failure).
+_HOT_SET_TTL = 300
+_HOT_SET_RETRY = 30   # back off this long after a failed/empty refresh
+_HOT_SET_LIMIT = 10000
+# One (emb, meta, loaded_at) tuple, swapped atomically so concurrent readers
+# never pair embeddings with metadata from a different snapshot; the lock
+# serializes refreshes. emb is (N, 768) float32 with L2-normalized rows.
+_hot_state: tuple = (None, [], 0.0)
+_hot_lock = threading.Lock()
+
+if _HAS_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _cosine_scores(q, emb):
+        n, d = emb.shape
+        out = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            s = 0.0
+            for j in range(d):
+                s += emb[i, j] * q[j]
+            out[i] = s
+        return out
+else:
+    def _cosine_scores(q, emb):
+        return emb @ q
+
+def _embedding_to_array(value) -> np.ndarray:
+    # Read connections register pgvector typecasters, so the embedding
+    # column arrives as a HalfVector; plain lists still work via asarray
+    if hasattr(value, "to_numpy"):
+        return np.asarray(value.to_numpy(), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+def _hot_state_fresh(state) -> bool:
+    emb, _, loaded_at = state
+    # Failed/empty refreshes are recorded too (emb None with a timestamp),
+    # on a short retry TTL so a broken snapshot can't add a bulk fetch to
+    # every single request
+    ttl = _HOT_SET_TTL if emb is not None else _HOT_SET_RETRY
+    return bool(loaded_at) and time.monotonic() - loaded_at <= ttl
+
+def _get_hot_set():
+    global _hot_state
+    state = _hot_state
+    if _hot_state_fresh(state):
+        return state[0], state[1]
+    with _hot_lock:
+        # Re-check under the lock: another thread may have refreshed while
+        # we waited, in which case its snapshot is the one to use
+        state = _hot_state
+        if _hot_state_fresh(state):
+            return state[0], state[1]
+        emb, meta = None, []
+        try:
+            rows = fetch_embedding_snapshot(_HOT_SET_LIMIT)
+            if rows:
+                emb = np.asarray([_embedding_to_array(row[6]) for row in rows])
+                # Normalize once at load so scoring is a plain dot product
+                norms = np.linalg.norm(emb, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                emb = emb / norms
+                meta = [row[:6] for row in rows]
+        except Exception as e:
+            print(f"❌ Hot-set refresh failed: {e}")
+            emb, meta = None, []
+        _hot_state = (emb, meta, time.monotonic())
+        return emb, meta
+
+_HOT_KEYS = ("content", "doc_name", "branch", "year", "valid_from", "valid_to")
+
+def _search_hot_set(embedding: list[float], top_k: int) -> Optional[list[dict]]:
+    """
+    Cosine top-k over the in-memory snapshot. Returns None when the caller
+    should fall back to fetch_similar_documents.
+    """
+    try:
+        emb, meta = _get_hot_set()
+        if emb is None or len(emb) >= _HOT_SET_LIMIT:
+            # Full snapshot means the corpus may be bigger than what we hold
+            return None
+        q = np.asarray(embedding, dtype=np.float32)
+        q_norm = np.linalg.norm(q)
+        if q_norm == 0:
+            return None
+        scores = _cosine_scores(q / q_norm, emb)
+        k = min(top_k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [
+            {**dict(zip(_HOT_KEYS, meta[i])), "similarity": float(scores[i])}
+            for i in top
+        ]
+    except Exception as e:
+        print(f"❌ Hot-set search failed, falling back to DB: {e}")
+        return None
+
+def _fetch_context(embedding, top_k, branch, year) -> list[dict]:
+    similar_docs = None
+    # Branch/year filters stay on the DB path where the indexes live
+    if (not branch or branch == "all") and (not year or year == "all"):
+        similar_docs = _search_hot_set(embedding, top_k)
+    if similar_docs is None:
+        similar_docs = fetch_similar_documents(embedding, top_k=top_k, branch=branch, year=year)
+    return similar_docs
+
+def answer_query(
+    query: str,
+    branch: Optional[str] = "all",
+    year: Optional[str] = "all",
+    *,
+    embedding: Optional[list[float]] = None
+) -> str:
     """
     Answer user query using context from the database and Google Gemini API.
+    Pass a precomputed query embedding to skip the internal embedding call.
     """
     try:
-        # Step 1: Get embedding for the query
-        query_embedding = get_embeddings([query])[0]
-        
-        # Step 2: Fetch similar documents from the database
-        similar_docs = fetch_similar_documents(query_embedding, top_k=7, branch=branch, year=year)
-        
+        # Step 1: Get embedding for the query (unless the caller already has it)
+        if embedding is None:
+            embedding = get_embeddings([query])[0]
+
+        # Step 2: Fetch similar documents (in-memory hot set or database)
+        similar_docs = _fetch_context(embedding, 7, branch, year)
+
         if not similar_docs:
             return "No relevant context found in the database."
         
@@ -35,7 +154,36 @@ def answer_query(query: str, branch: Optional[str] = "all", year: Optional[str]
     except Exception as e:
         print(f"❌ Error answering query: {e}")
         return "Error processing your query."
-    
+
+def answer_query_stream(
+    query: str,
+    branch: Optional[str] = "all",
+    year: Optional[str] = "all",
+    *,
+    embedding: Optional[list[float]] = None
+):
+    """
+    Same as answer_query, but yields the answer piece by piece as Gemini
+    generates it so the caller can render incrementally.
+    """
+    try:
+        if embedding is None:
+            embedding = get_embeddings([query])[0]
+
+        similar_docs = _fetch_context(embedding, 7, branch, year)
+
+        if not similar_docs:
+            yield "No relevant context found in the database."
+            return
+
+        context = [{"content": doc["content"], "doc_name": doc["doc_name"]} for doc in similar_docs]
+
+        yield from get_gemini_response_stream(context, query)
+
+    except Exception as e:
+        print(f"❌ Error answering query: {e}")
+        yield "Error processing your query."
+
 if __name__ == "__main__":
     user_query = "What courses in fifth semester?"
     branch = "all"
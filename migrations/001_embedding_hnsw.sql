@@ -0,0 +1,13 @@
+-- ANN and filter indexes for the documents table.
+-- Run once against the existing database:
+--   psql "$DATABASE_URL" -f migrations/001_embedding_hnsw.sql
+
+-- Similarity search currently seq-scans and sorts the whole table per query.
+-- HNSW turns that into a graph traversal (pgvector defaults: m=16, ef_construction=64).
+CREATE INDEX IF NOT EXISTS documents_embedding_hnsw
+    ON documents USING hnsw (embedding vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+-- Speeds up the branch/year filtered variants of the search.
+CREATE INDEX IF NOT EXISTS documents_branch_year_idx
+    ON documents (branch, year);
@@ -0,0 +1,6 @@
+-- Composite index backing the GROUP BY in /documents/list/ so the listing
+-- becomes an index scan instead of sorting every chunk row.
+--   psql "$DATABASE_URL" -f migrations/002_list_documents_index.sql
+
+CREATE INDEX IF NOT EXISTS documents_doc_branch_year_idx
+    ON documents (doc_name, branch, year);
@@ -0,0 +1,17 @@
+-- Content hashes for chunk dedup, so re-uploading a mostly-unchanged PDF
+-- skips embedding and re-inserting chunks that are already stored.
+--   psql "$DATABASE_URL" -f migrations/003_content_hash.sql
+
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash CHAR(40);
+
+-- Backfill existing rows (sha1 hex, matching hashlib.sha1(...).hexdigest())
+UPDATE documents
+SET content_hash = encode(digest(content, 'sha1'), 'hex')
+WHERE content_hash IS NULL;
+
+-- Plain (non-unique) index: the same boilerplate chunk can legitimately
+-- appear in several documents; dedup is enforced in the ingest path.
+CREATE INDEX IF NOT EXISTS documents_content_hash_idx
+    ON documents (content_hash);
@@ -0,0 +1,12 @@
+-- Rebuild the ANN index with tuned build parameters: m=24 / ef_construction=128
+-- holds recall noticeably better than the defaults once the corpus grows past
+-- a few tens of thousands of chunks, for a modest one-time build cost.
+-- CONCURRENTLY keeps the query path available during the rebuild; run this
+-- file outside a transaction block:
+--   psql "$DATABASE_URL" -f migrations/004_hnsw_tuning.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS documents_embedding_hnsw_m24
+    ON documents USING hnsw (embedding vector_cosine_ops)
+    WITH (m = 24, ef_construction = 128);
+
+DROP INDEX CONCURRENTLY IF EXISTS documents_embedding_hnsw;
@@ -0,0 +1,8 @@
+-- First-stage ANN index over 1-bit quantized embeddings. Hamming distance on
+-- bit(768) moves 32x fewer bytes per comparison than halfvec cosine; the
+-- query path re-ranks the candidate pool with exact cosine, keeping recall
+-- close to the float baseline.
+--   psql "$DATABASE_URL" -f migrations/006_binary_quantize_index.sql
+
+CREATE INDEX IF NOT EXISTS documents_embedding_bq_hnsw
+    ON documents USING hnsw ((binary_quantize(embedding)::bit(768)) bit_hamming_ops);